@@ -1,3 +1,4 @@
+import hashlib
 import random
 
 import numpy
@@ -44,11 +45,43 @@ class Chip8:
         [0xF0, 0x80, 0xF0, 0x80, 0xF0],  # e
         [0xF0, 0x80, 0xF0, 0x80, 0x80],  # f
     ]
+    # what the default handlers do for each quirk
+    quirk_defaults = {"shift": "vy", "load_store": "increment", "draw": "clip", "jump": "v0"}
+    # handlers replacing the default ones for each other quirk setting
+    quirk_handlers = {
+        "shift": {
+            "vx": {(0x8, 0x6): "_8XY6_vx", (0x8, 0xE): "_8XYE_vx"},
+        },
+        "load_store": {
+            "keep": {(0xF, 0x55): "_FX55_keep_i", (0xF, 0x65): "_FX65_keep_i"},
+            "increment_x": {(0xF, 0x55): "_FX55_add_x", (0xF, 0x65): "_FX65_add_x"},
+        },
+        "draw": {
+            "wrap": {(0xD, None): "_DXYN_wrap"},
+        },
+        "jump": {
+            "vx": {(0xB, None): "_BXNN"},
+        },
+    }
+    quirk_profiles = {
+        "cosmac_vip": {"shift": "vy", "load_store": "increment", "draw": "clip", "jump": "v0"},
+        "chip48": {"shift": "vx", "load_store": "increment_x", "draw": "clip", "jump": "vx"},
+        "schip": {"shift": "vx", "load_store": "keep", "draw": "clip", "jump": "vx"},
+        "modern": {"shift": "vx", "load_store": "keep", "draw": "wrap", "jump": "v0"},
+    }
+    # sha1 of rom file: quirk profile, used by quirks="auto"
+    rom_profiles = {}
 
-    def __init__(self, chip_file):
+    def __init__(self, chip_file, quirks=None):
         """Chip8 interpreter
 
         Chip file is BinaryIO stream of chip program
+
+        Quirks is a name from quirk_profiles, a dict of quirk settings or
+        "auto" to look the rom up in rom_profiles. The matching variant
+        handlers are put in opcode_map once here, so no quirk is checked
+        while running. Without quirks the default handlers behave like
+        the cosmac_vip profile.
         
         Chip 8 Memory layout using wikipedia article as reference:
         4096 (0x1000) total mem
@@ -109,9 +142,36 @@ class Chip8:
                 0x65: self._FX65,
             },
         }
+        self.apply_quirks(quirks)
         self.set_font(self.font_list)
         self.map_code_to_mem(self.chip_file, len(self.chip_file))
 
+    def apply_quirks(self, quirks):
+        if quirks == "auto":
+            quirks = self.rom_profiles.get(hashlib.sha1(self.chip_file).hexdigest())
+        if quirks is None:
+            return
+        if isinstance(quirks, str):
+            if quirks not in self.quirk_profiles:
+                raise ValueError(f"Unknown quirk profile {quirks}.")
+            quirks = self.quirk_profiles[quirks]
+        for quirk, setting in quirks.items():
+            if quirk not in self.quirk_defaults:
+                raise ValueError(
+                    f"Unknown quirk {quirk}, expected one of {', '.join(self.quirk_defaults)}."
+                )
+            settings = [self.quirk_defaults[quirk], *self.quirk_handlers[quirk]]
+            if setting not in settings:
+                raise ValueError(
+                    f"Unknown setting {setting} for quirk {quirk}, expected one of {', '.join(settings)}."
+                )
+            handlers = self.quirk_handlers[quirk].get(setting, {})
+            for (first_nibble, key), name in handlers.items():
+                if key is None:
+                    self.opcode_map[first_nibble] = getattr(self, name)
+                else:
+                    self.opcode_map[first_nibble][key] = getattr(self, name)
+
     def set_font(self, font_list):
         i = 0
         for sprite in font_list:
@@ -305,6 +365,17 @@ class Chip8:
         self.state["v"][0xF] = lsb
         self.state["v"][x] = self.state["v"][y] >> 1
 
+    def _8XY6_vx(self):
+        """
+            Shift register VX right one bit, VY is ignored
+
+            Set register VF to the least significant bit prior to the shift
+        """
+        x = (self.opcode & 0x0F00) >> 0x8
+        lsb = self.state["v"][x] & 0x1
+        self.state["v"][x] >>= 1
+        self.state["v"][0xF] = lsb
+
     def _8XY7(self):
         """
             Set register VX to the value of VY minus VX
@@ -334,6 +405,17 @@ class Chip8:
         self.state["v"][x] = self.state["v"][y] << 1
         self.state["v"][x] &= 0xFF
 
+    def _8XYE_vx(self):
+        """
+            Shift register VX left one bit, VY is ignored
+
+            Set register VF to the most significant bit prior to the shift
+        """
+        x = (self.opcode & 0x0F00) >> 0x8
+        msb = (self.state["v"][x] & 0x80) >> 7
+        self.state["v"][x] = (self.state["v"][x] << 1) & 0xFF
+        self.state["v"][0xF] = msb
+
     def _9XY0(self):
         """
             Skip the following instruction if the value of register VX is not equal to the value of register VY
@@ -357,6 +439,14 @@ class Chip8:
         addr += self.state["v"][0]
         self.state["pc"] = addr
 
+    def _BXNN(self):
+        """Jump to address XNN + VX
+        """
+        x = (self.opcode & 0x0F00) >> 0x8
+        addr = self.opcode & 0x0FFF
+        addr += self.state["v"][x]
+        self.state["pc"] = addr
+
     def _CXNN(self):
         """Set VX to a random number with a mask of NN
         """
@@ -391,6 +481,31 @@ class Chip8:
                 self.state["display"][vy + y][vx + x] = new_byte ^ old_byte
         self.state["v"][0xF] = 1 if unset else 0
 
+    def _DXYN_wrap(self):
+        """
+            Draw a sprite at position VX, VY with N bytes of sprite
+            data starting at the address stored in I, wrapping
+            pixels past the edges around to the other side
+
+            Set VF to 01 if any set pixels are changed to unset,
+            and 00 otherwise
+        """
+        x = (self.opcode & 0x0F00) >> 0x8
+        y = (self.opcode & 0x00F0) >> 0x4
+        vx, vy = self.state["v"][x], self.state["v"][y]
+        n = self.opcode & 0xF
+        unset = False
+        for y in range(n):
+            sprite_byte = self.state["memory"][self.state["i"] + y]
+            row = self.state["display"][(vy + y) % 32]
+            for x in range(8):
+                new_byte = (sprite_byte & (1 << (8 - x - 1))) >> (8 - x - 1)
+                old_byte = row[(vx + x) % 64]
+                if old_byte and not (old_byte ^ new_byte):
+                    unset = True
+                row[(vx + x) % 64] = new_byte ^ old_byte
+        self.state["v"][0xF] = 1 if unset else 0
+
     def _EX9E(self):
         """
             Skip the following instruction if the key corresponding 
@@ -479,6 +594,26 @@ class Chip8:
             self.state["memory"][addr + i] = self.state["v"][i]
         self.state["i"] = addr + x + 1
 
+    def _FX55_keep_i(self):
+        """
+            Store the values of registers V0 to VX inclusive in memory starting at address I
+
+            I is left unchanged
+        """
+        x = (self.opcode & 0x0F00) >> 0x8
+        addr = self.state["i"]
+        for i in range(0, x + 1):
+            self.state["memory"][addr + i] = self.state["v"][i]
+
+    def _FX55_add_x(self):
+        """
+            Store the values of registers V0 to VX inclusive in memory starting at address I
+
+            I is set to I + X after operation
+        """
+        self._FX55_keep_i()
+        self.state["i"] += (self.opcode & 0x0F00) >> 0x8
+
     def _FX65(self):
         """
             Fill registers V0 to VX inclusive with the values stored in memory starting at address I
@@ -491,3 +626,24 @@ class Chip8:
             self.state["v"][i] = self.state["memory"][addr + i]
             self.state["v"][i] &= 0xFF
         self.state["i"] = addr + x + 1
+
+    def _FX65_keep_i(self):
+        """
+            Fill registers V0 to VX inclusive with the values stored in memory starting at address I
+
+            I is left unchanged
+        """
+        x = (self.opcode & 0x0F00) >> 0x8
+        addr = self.state["i"]
+        for i in range(0, x + 1):
+            self.state["v"][i] = self.state["memory"][addr + i]
+            self.state["v"][i] &= 0xFF
+
+    def _FX65_add_x(self):
+        """
+            Fill registers V0 to VX inclusive with the values stored in memory starting at address I
+
+            I is set to I + X after operation
+        """
+        self._FX65_keep_i()
+        self.state["i"] += (self.opcode & 0x0F00) >> 0x8
@@ -0,0 +1,476 @@
+"""
+Debugger for the Chip 8 interpreter
+
+Breakpoints and watchpoints never add checks to the run loop. While
+running, the opcode_map entries that can hit them are wrapped in traps:
+the handler of the instruction at each breakpoint address, and the
+handlers that access memory (_2NNN/_00EE for the stack, _DXYN, _FX33,
+_FX55 and _FX65 through I) while watchpoints exist. Every other
+instruction runs its plain handler. Traps are removed when run() returns.
+"""
+import cmd
+import signal
+from collections import defaultdict
+
+from chip8 import Chip8
+
+STACK_BASE = 0xEA0
+
+# handlers touching memory, with the addresses they access before running
+WATCHED_HANDLERS = {
+    (0x0, 0xE): ("read", lambda state, opcode: range(state["sp"] - 1, state["sp"])),
+    (0x2, None): ("write", lambda state, opcode: range(state["sp"], state["sp"] + 1)),
+    (0xD, None): ("read", lambda state, opcode: range(state["i"], state["i"] + (opcode & 0xF))),
+    (0xF, 0x33): ("write", lambda state, opcode: range(state["i"], state["i"] + 3)),
+    (0xF, 0x55): (
+        "write",
+        lambda state, opcode: range(state["i"], state["i"] + ((opcode & 0x0F00) >> 0x8) + 1),
+    ),
+    (0xF, 0x65): (
+        "read",
+        lambda state, opcode: range(state["i"], state["i"] + ((opcode & 0x0F00) >> 0x8) + 1),
+    ),
+}
+
+
+def opcode_key(opcode):
+    """Where opcode_switch finds the handler for opcode, as (first nibble, sub key)"""
+    first_nibble = (opcode & 0xF000) >> 0xC
+    if first_nibble == 0xF:
+        return first_nibble, opcode & 0x00FF
+    if first_nibble in (0x0, 0x8, 0xE):
+        return first_nibble, opcode & 0x000F
+    return first_nibble, None
+
+
+class Stop(Exception):
+    """Raised by a trap to leave the run loop, args[0] is the reason or None"""
+
+
+class Breakpoint:
+    def __init__(self, address, condition=None, source=None, temporary=False):
+        """PC breakpoint
+
+        Condition is an optional callable taking the chip8 state dict,
+        the breakpoint only fires when it returns something truthy.
+        Source is the text the condition was compiled from, kept for listing.
+        Temporary breakpoints are used by next and finish and are removed
+        when the run they were set for ends.
+        """
+        self.address = address
+        self.condition = condition
+        self.source = source
+        self.temporary = temporary
+
+    def hit(self, state):
+        return self.condition is None or self.condition(state)
+
+    def __str__(self):
+        if self.source:
+            return f"{self.address:04x} if {self.source}"
+        return f"{self.address:04x}"
+
+
+class Watchpoint:
+    def __init__(self, start, end, read=False, write=True):
+        """Memory watchpoint over the addresses start..end inclusive"""
+        self.start = start
+        self.end = end
+        self.read = read
+        self.write = write
+
+    def addresses(self):
+        return range(self.start, self.end + 1)
+
+    def __str__(self):
+        mode = ("r" if self.read else "") + ("w" if self.write else "")
+        return f"{self.start:04x}-{self.end:04x} {mode}"
+
+
+class Chip8Debugger:
+
+    def __init__(self, chip8, pressed_keys=None):
+        """Breakpoints, watchpoints and stepping for a Chip8 instance
+
+        Pressed keys default to nothing held, chip8 indexes them with
+        pygame key constants so any mapping defaulting to False works.
+        """
+        self.chip8 = chip8
+        self.pressed_keys = pressed_keys if pressed_keys is not None else defaultdict(bool)
+        self.breakpoints = {}
+        self.watchpoints = []
+        self.read_addresses = set()
+        self.write_addresses = set()
+        self.resuming = False
+        self.pending_stop = None
+        self.trapped = {}
+
+    @property
+    def state(self):
+        return self.chip8.state
+
+    def opcode_at(self, address):
+        memory = self.state["memory"]
+        return memory[address] << 0x8 | memory[address + 1]
+
+    def current_opcode(self):
+        return self.opcode_at(self.state["pc"])
+
+    def add_breakpoint(self, address, condition=None, source=None, temporary=False):
+        """Break when PC reaches address, conditions on the same address are or-ed"""
+        if not 0 <= address < len(self.state["memory"]) - 1:
+            raise ValueError(f"Breakpoint address {address:04x} is outside memory.")
+        self.breakpoints.setdefault(address, []).append(
+            Breakpoint(address, condition, source, temporary)
+        )
+
+    def remove_breakpoint(self, address):
+        self.breakpoints.pop(address, None)
+
+    def remove_temporary_breakpoints(self):
+        for address in list(self.breakpoints):
+            kept = [bp for bp in self.breakpoints[address] if not bp.temporary]
+            if kept:
+                self.breakpoints[address] = kept
+            else:
+                del self.breakpoints[address]
+
+    def add_watchpoint(self, start, end=None, read=False, write=True):
+        watchpoint = Watchpoint(start, start if end is None else end, read, write)
+        self.watchpoints.append(watchpoint)
+        self.collect_watched_addresses()
+        return watchpoint
+
+    def remove_watchpoint(self, watchpoint):
+        self.watchpoints.remove(watchpoint)
+        self.collect_watched_addresses()
+
+    def collect_watched_addresses(self):
+        self.read_addresses = set()
+        self.write_addresses = set()
+        for watchpoint in self.watchpoints:
+            if watchpoint.read:
+                self.read_addresses.update(watchpoint.addresses())
+            if watchpoint.write:
+                self.write_addresses.update(watchpoint.addresses())
+
+    def get_handler(self, key):
+        first_nibble, sub_key = key
+        if sub_key is None:
+            return self.chip8.opcode_map[first_nibble]
+        return self.chip8.opcode_map[first_nibble].get(sub_key)
+
+    def set_handler(self, key, handler):
+        first_nibble, sub_key = key
+        if sub_key is None:
+            self.chip8.opcode_map[first_nibble] = handler
+        elif handler is None:
+            self.chip8.opcode_map[first_nibble].pop(sub_key, None)
+        else:
+            self.chip8.opcode_map[first_nibble][sub_key] = handler
+
+    def install_traps(self):
+        """Wrap the handlers that can hit a breakpoint or watchpoint
+
+        The handler trapped for a breakpoint is the one of the instruction
+        at its address when the run starts, code rewriting the breakpoint
+        address into another instruction type while running is missed.
+        """
+        breaks = {opcode_key(self.opcode_at(address)) for address in self.breakpoints}
+        watches = {
+            key
+            for key, (kind, _) in WATCHED_HANDLERS.items()
+            if (self.read_addresses if kind == "read" else self.write_addresses)
+        }
+        for key in breaks | watches:
+            handler = self.get_handler(key)
+            self.trapped[key] = handler
+            self.set_handler(
+                key, self.trap(handler, key in breaks, WATCHED_HANDLERS[key] if key in watches else None)
+            )
+
+    def remove_traps(self):
+        for key, handler in self.trapped.items():
+            self.set_handler(key, handler)
+        self.trapped = {}
+
+    def trap(self, handler, check_break, watch):
+        chip8 = self.chip8
+
+        def trapped():
+            state = chip8.state
+            pc = state["pc"] - 2
+            if check_break and not self.resuming:
+                self.check_break(pc)
+            if watch:
+                kind, accessed = watch
+                watched = self.read_addresses if kind == "read" else self.write_addresses
+                hits = [address for address in accessed(state, chip8.opcode) if address in watched]
+            if handler:
+                handler()
+            else:
+                print(f"{chip8.opcode} not implemented.")
+            if watch and hits:
+                self.arm_watch(pc, kind, hits)
+
+        return trapped
+
+    def check_break(self, pc):
+        """Stop before the instruction at pc if one of its breakpoints hits"""
+        breakpoints = self.breakpoints.get(pc)
+        if not breakpoints:
+            return
+        state = self.state
+        state["pc"] = pc
+        try:
+            hit = [bp for bp in breakpoints if bp.hit(state)]
+        except Exception as error:
+            raise Stop(f"breakpoint condition at {pc:04x} failed: {error!r}")
+        if hit:
+            raise Stop(None if all(bp.temporary for bp in hit) else f"breakpoint at {pc:04x}")
+        state["pc"] = pc + 2
+
+    def arm_watch(self, pc, kind, hits):
+        """Stop before the next instruction, after timers of this one ran
+
+        Raising inside the handler would skip the timer update in
+        fetch_next_opcode, so the next opcode_switch call raises instead.
+        """
+        memory = self.state["memory"]
+        described = ", ".join(
+            f"{kind} {address:04x}" + (f"={memory[address]:02x}" if kind == "write" else "")
+            for address in hits
+        )
+        self.arm_stop(f"watchpoint at {pc:04x}: {described}")
+
+    def arm_stop(self, reason):
+        if self.pending_stop:
+            self.pending_stop += f", {reason}"
+        else:
+            self.pending_stop = reason
+        self.chip8.opcode_switch = self.pending_stop_trap
+
+    def pending_stop_trap(self, opcode, pressed_keys):
+        self.state["pc"] -= 2
+        raise Stop(self.disarm_stop())
+
+    def disarm_stop(self):
+        reason = self.pending_stop
+        self.pending_stop = None
+        self.chip8.__dict__.pop("opcode_switch", None)
+        return reason
+
+    def interrupt(self, signum, frame):
+        """Ctrl-C stops before the next instruction instead of inside one"""
+        self.arm_stop("interrupted")
+
+    def run(self, max_steps=None):
+        """Run until a breakpoint, watchpoint or max_steps
+
+        A breakpoint on the first instruction is skipped, so a stopped
+        debugger can continue past the breakpoint it stopped on.
+        Returns the reason execution stopped, None for next and finish
+        reaching their target.
+        """
+        if max_steps == 0:
+            return "stopped after 0 steps"
+        fetch = self.chip8.fetch_next_opcode
+        keys = self.pressed_keys
+        self.install_traps()
+        try:
+            sigint = signal.signal(signal.SIGINT, self.interrupt)
+        except ValueError:
+            # not the main thread, Ctrl-C can't be caught here
+            sigint = None
+        try:
+            self.resuming = True
+            fetch(keys)
+            self.resuming = False
+            if max_steps is None:
+                while True:
+                    fetch(keys)
+            for _ in range(max_steps - 1):
+                fetch(keys)
+            reason = f"stopped after {max_steps} steps"
+        except Stop as stop:
+            reason = stop.args[0]
+        finally:
+            if sigint is not None:
+                signal.signal(signal.SIGINT, sigint)
+            self.resuming = False
+            self.remove_traps()
+            self.remove_temporary_breakpoints()
+            pending = self.disarm_stop()
+        return pending or reason
+
+    def step(self):
+        """Execute a single instruction, returns the stop reason if a watchpoint fired"""
+        reason = self.run(1)
+        return None if reason == "stopped after 1 steps" else reason
+
+    def step_over(self, max_steps=None):
+        """Step, running a _2NNN subroutine call to completion"""
+        if self.current_opcode() & 0xF000 != 0x2000:
+            return self.step()
+        sp = self.state["sp"]
+        self.add_breakpoint(
+            self.state["pc"] + 2, lambda state: state["sp"] == sp, temporary=True
+        )
+        return self.run(max_steps)
+
+    def run_to_return(self, max_steps=None):
+        """Run until the current subroutine returns with _00EE"""
+        sp = self.state["sp"]
+        if sp <= STACK_BASE:
+            return "not in a subroutine"
+        self.add_breakpoint(
+            self.state["memory"][sp - 1], lambda state: state["sp"] == sp - 1, temporary=True
+        )
+        return self.run(max_steps)
+
+
+def parse_number(text):
+    """Numbers in the console are hex, 0x prefix optional"""
+    return int(text, 16)
+
+
+class Chip8Console(cmd.Cmd):
+    intro = "Chip8 debugger, type help or ? to list commands."
+    prompt = "(chip8) "
+
+    def __init__(self, debugger):
+        cmd.Cmd.__init__(self)
+        self.debugger = debugger
+
+    def onecmd(self, line):
+        """Keep the prompt alive on bad input or Ctrl-C while running"""
+        try:
+            return cmd.Cmd.onecmd(self, line)
+        except KeyboardInterrupt:
+            self.report("interrupted")
+        except Exception as error:
+            print(f"error: {error!r}")
+
+    def report(self, reason):
+        if reason:
+            print(reason)
+        self.do_where("")
+
+    def do_break(self, arg):
+        """break ADDR [if EXPR]: break when PC reaches ADDR
+
+        EXPR is python evaluated with v, i, pc, sp, delay and sound in scope,
+        e.g. break 2a0 if v[3] == 0x10
+        """
+        address, _, source = arg.partition(" if ")
+        condition = None
+        if source:
+            code = compile(source, "<breakpoint>", "eval")
+            condition = lambda state: eval(code, {}, dict(state))
+            # fail now on names that don't exist rather than when hit
+            condition(self.debugger.state)
+        self.debugger.add_breakpoint(parse_number(address), condition, source or None)
+
+    def do_delete(self, arg):
+        """delete ADDR: remove breakpoints at ADDR"""
+        self.debugger.remove_breakpoint(parse_number(arg))
+
+    def do_watch(self, arg):
+        """watch START [END] [r|w|rw]: watch memory accesses, default is writes"""
+        args = arg.split()
+        mode = "w"
+        if args and args[-1] in ("r", "w", "rw"):
+            mode = args.pop()
+        if not args:
+            raise ValueError("watch needs an address.")
+        start = parse_number(args[0])
+        end = parse_number(args[1]) if len(args) > 1 else None
+        self.debugger.add_watchpoint(start, end, read="r" in mode, write="w" in mode)
+
+    def do_unwatch(self, arg):
+        """unwatch N: remove watchpoint number N as shown by info"""
+        n = int(arg)
+        if not 0 <= n < len(self.debugger.watchpoints):
+            raise ValueError(f"No watchpoint {n}.")
+        self.debugger.remove_watchpoint(self.debugger.watchpoints[n])
+
+    def do_info(self, arg):
+        """info: list breakpoints and watchpoints"""
+        for breakpoints in self.debugger.breakpoints.values():
+            for breakpoint in breakpoints:
+                if not breakpoint.temporary:
+                    print(f"break {breakpoint}")
+        for n, watchpoint in enumerate(self.debugger.watchpoints):
+            print(f"watch {n}: {watchpoint}")
+
+    def do_step(self, arg):
+        """step [N]: execute N instructions"""
+        count = int(arg) if arg else 1
+        reason = self.debugger.run(count)
+        self.report(None if reason.startswith("stopped") else reason)
+
+    def do_next(self, arg):
+        """next: step, running subroutine calls to completion"""
+        self.report(self.debugger.step_over())
+
+    def do_finish(self, arg):
+        """finish: run until the current subroutine returns"""
+        self.report(self.debugger.run_to_return())
+
+    def do_continue(self, arg):
+        """continue [N]: run until a breakpoint or watchpoint, at most N instructions"""
+        self.report(self.debugger.run(int(arg) if arg else None))
+
+    def do_where(self, arg):
+        """where: show PC and the instruction about to execute"""
+        print(f"{self.debugger.state['pc']:04x} {self.debugger.current_opcode():04x}")
+
+    def do_regs(self, arg):
+        """regs: show registers and timers"""
+        state = self.debugger.state
+        print(" ".join(f"v{n:x}={value:02x}" for n, value in enumerate(state["v"])))
+        print(
+            f"i={state['i']:04x} pc={state['pc']:04x} sp={state['sp']:04x} "
+            f"delay={state['delay']} sound={state['sound']}"
+        )
+
+    def do_mem(self, arg):
+        """mem ADDR [LEN]: dump LEN (default 10) bytes of memory from ADDR"""
+        args = arg.split()
+        if not args:
+            raise ValueError("mem needs an address.")
+        start = parse_number(args[0])
+        length = parse_number(args[1]) if len(args) > 1 else 0x10
+        memory = self.debugger.state["memory"]
+        for row in range(start, start + length, 0x10):
+            values = memory[row : min(row + 0x10, start + length)]
+            print(f"{row:04x} " + " ".join(f"{value:02x}" for value in values))
+
+    def do_key(self, arg):
+        """key HEX: toggle chip 8 key HEX being held"""
+        key = Chip8.keys_rev[parse_number(arg)]
+        self.debugger.pressed_keys[key] = not self.debugger.pressed_keys[key]
+
+    def do_quit(self, arg):
+        """quit: exit the debugger"""
+        return True
+
+    do_b = do_break
+    do_s = do_step
+    do_n = do_next
+    do_c = do_continue
+    do_q = do_quit
+
+
+if __name__ == "__main__":
+    import sys
+
+    import pygame
+
+    if len(sys.argv) == 2:
+        pygame.mixer.pre_init(44100, -16, 1)
+        pygame.init()
+        with open(sys.argv[1], "rb") as chip_file:
+            Chip8Console(Chip8Debugger(Chip8(chip_file))).cmdloop()
+    else:
+        print("Please supply chip 8 program.")
@@ -0,0 +1,344 @@
+"""
+Differential opcode fuzzer
+
+Runs random and structured instruction streams on the reference Chip8
+handlers and on a candidate engine, diffing the machine state after every
+step. Engines are given as "module:attribute" of a class or factory taking
+a chip file like Chip8 and returning an object with state and
+fetch_next_opcode(pressed_keys).
+
+Both engines are built fresh for every run of a case from the case's
+program, so engines may compile or cache the rom when constructed. The
+randomized registers, stack, memory outside the program and display are
+then written in place into the engine's state dict, which engines must
+keep reading live like Chip8 does.
+"""
+import copy
+import importlib
+import io
+import json
+import os
+import random
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+
+from chip8 import Chip8
+
+REFERENCE = "chip8:Chip8"
+FIELDS = ("v", "i", "pc", "sp", "delay", "sound", "memory", "display")
+
+# one template per implemented instruction, fields get filled in randomly
+TEMPLATES = (
+    "00E0", "00EE", "1NNN", "2NNN", "3XNN", "4XNN", "5XY0", "6XNN", "7XNN",
+    "8XY0", "8XY1", "8XY2", "8XY3", "8XY4", "8XY5", "8XY6", "8XY7", "8XYE",
+    "9XY0", "ANNN", "BNNN", "CXNN", "DXYN", "EX9E", "EXA1", "FX07", "FX0A",
+    "FX15", "FX18", "FX1E", "FX29", "FX33", "FX55", "FX65",
+)
+
+
+def load_engine(spec):
+    module, _, attribute = spec.partition(":")
+    return getattr(importlib.import_module(module), attribute)
+
+
+def init_worker():
+    import pygame
+
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    pygame.mixer.init(44100, -16, 1)
+
+
+def structured_program(rng, length):
+    """Valid instructions, jumps and calls land inside the program"""
+    program = bytearray()
+    for _ in range(length):
+        template = rng.choice(TEMPLATES)
+        if "NNN" in template:
+            if template[0] in "12":
+                nnn = 0x200 + 2 * rng.randrange(length)
+            else:
+                nnn = rng.randrange(0xF00)
+            template = template.replace("NNN", f"{nnn:03X}")
+        template = template.replace("NN", f"{rng.randrange(0x100):02X}")
+        for field in "XYN":
+            template = template.replace(field, f"{rng.randrange(0x10):X}")
+        program += int(template, 16).to_bytes(2, "big")
+    return bytes(program)
+
+
+def random_program(rng, length):
+    return bytes(rng.randrange(0x100) for _ in range(2 * length))
+
+
+def random_state(rng, program):
+    """Random registers, timers, stack, memory and display around program"""
+    memory = [rng.randrange(0x100) for _ in range(4096)]
+    font = [byte for sprite in Chip8.font_list for byte in sprite]
+    memory[: len(font)] = font
+    depth = rng.randrange(8)
+    for n in range(depth):
+        memory[0xEA0 + n] = 0x200 + 2 * rng.randrange(max(1, len(program) // 2))
+    return {
+        "v": [rng.randrange(0x100) for _ in range(16)],
+        "i": rng.randrange(0xF00),
+        "delay": rng.randrange(0x100),
+        "sound": rng.choice((0, rng.randrange(0x100))),
+        "pc": 0x200,
+        "sp": 0xEA0 + depth,
+        "memory": memory,
+        "display": [[rng.randrange(2) for _ in range(64)] for _ in range(32)],
+    }
+
+
+def generate_case(seed, steps):
+    rng = random.Random(seed)
+    length = rng.randrange(1, 32)
+    if rng.random() < 0.8:
+        program = structured_program(rng, length)
+    else:
+        program = random_program(rng, length)
+    return {
+        "seed": seed,
+        "steps": steps,
+        "program": program,
+        "keys": [key for key in range(0x10) if rng.random() < 0.25],
+        "state": random_state(rng, program),
+    }
+
+
+def build_engine(factory, case):
+    """Construct an engine from the case's program and write in the case state
+
+    Memory holding the program is left as the engine loaded it, every other
+    field is assigned in place so references the engine holds stay valid.
+    """
+    engine = factory(io.BytesIO(case["program"]))
+    state = engine.state
+    expected = case["state"]
+    program_start = expected["pc"]
+    program_end = program_start + len(case["program"])
+    memory = state["memory"]
+    memory[:program_start] = expected["memory"][:program_start]
+    memory[program_end:] = expected["memory"][program_end:]
+    state["v"][:] = expected["v"]
+    for row, expected_row in zip(state["display"], expected["display"]):
+        row[:] = expected_row
+    for field in ("i", "delay", "sound", "pc", "sp"):
+        state[field] = expected[field]
+    return engine
+
+
+def snapshot(engine):
+    state = engine.state
+    return {
+        "v": list(state["v"]),
+        "i": state["i"],
+        "pc": state["pc"],
+        "sp": state["sp"],
+        "delay": state["delay"],
+        "sound": state["sound"],
+        "memory": list(state["memory"]),
+        "display": [list(row) for row in state["display"]],
+    }
+
+
+def execute(engine, pressed_keys, seed):
+    """Single step, _CXNN draws from the global random module so seed it"""
+    random.seed(seed)
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            engine.fetch_next_opcode(pressed_keys)
+    except Exception as error:
+        return type(error).__name__, output.getvalue()
+    return None, output.getvalue()
+
+
+def describe(field, expected, actual):
+    if field in ("memory", "display"):
+        if field == "display":
+            expected = [cell for row in expected for cell in row]
+            actual = [cell for row in actual for cell in row]
+        diff = [n for n, (a, b) in enumerate(zip(expected, actual)) if a != b]
+        if not diff:
+            return f"{field} length: {len(expected)} != {len(actual)}"
+        return f"{field} differs at {len(diff)} cells, first {diff[0]:#05x}: {expected[diff[0]]} != {actual[diff[0]]}"
+    return f"{field}: {expected} != {actual}"
+
+
+def run_case(reference_factory, candidate_factory, case):
+    """Returns None if engines agree, else (step, description) of first mismatch"""
+    reference = build_engine(reference_factory, case)
+    try:
+        candidate = build_engine(candidate_factory, case)
+    except Exception as error:
+        return 0, f"candidate rejected case state: {error!r}"
+    pressed_keys = defaultdict(bool, {Chip8.keys_rev[key]: True for key in case["keys"]})
+    for step in range(case["steps"]):
+        pc = reference.state["pc"]
+        seed = case["seed"] << 16 | step
+        expected_result = execute(reference, pressed_keys, seed)
+        actual_result = execute(candidate, pressed_keys, seed)
+        if expected_result != actual_result:
+            return step, f"at {pc:04x} raised/printed {expected_result} != {actual_result}"
+        expected = snapshot(reference)
+        try:
+            actual = snapshot(candidate)
+        except Exception as error:
+            return step, f"at {pc:04x} candidate state unreadable: {error!r}"
+        for field in FIELDS:
+            if expected[field] != actual[field]:
+                return step, f"at {pc:04x} " + describe(field, expected[field], actual[field])
+        if expected_result[0]:
+            # both raised the same exception, nothing left to compare
+            return None
+    return None
+
+
+def minimize(reference_factory, candidate_factory, case):
+    """Shrink a failing case while it keeps failing
+
+    Cuts the steps to the first mismatch, drops instructions one at a time,
+    then resets registers, timers, keys, display and memory to zero.
+    """
+    fails = lambda case: run_case(reference_factory, candidate_factory, case) is not None
+    step, _ = run_case(reference_factory, candidate_factory, case)
+    case = dict(case, steps=step + 1, state=copy.deepcopy(case["state"]))
+
+    n = 0
+    while n < len(case["program"]) // 2 and len(case["program"]) > 2:
+        program = case["program"][: 2 * n] + case["program"][2 * n + 2 :]
+        if fails(dict(case, program=program)):
+            case["program"] = program
+        else:
+            n += 1
+
+    def attempt(path, value):
+        state = copy.deepcopy(case["state"])
+        target = state
+        for key in path[:-1]:
+            target = target[key]
+        if target[path[-1]] == value:
+            return
+        target[path[-1]] = value
+        if fails(dict(case, state=state)):
+            case["state"] = state
+
+    if case["keys"] and fails(dict(case, keys=[])):
+        case["keys"] = []
+    for register in range(16):
+        attempt(("v", register), 0)
+    for field in ("i", "delay", "sound"):
+        attempt((field,), 0)
+    attempt(("display",), [[0] * 64 for _ in range(32)])
+    font_end = sum(len(sprite) for sprite in Chip8.font_list)
+    for start in range(font_end, 4096, 0x100):
+        memory = case["state"]["memory"]
+        cleared = memory[:start] + [0] * len(memory[start : start + 0x100]) + memory[start + 0x100 :]
+        attempt(("memory",), cleared)
+    return case
+
+
+def run_shard(reference_spec, candidate_spec, seeds, steps):
+    reference = load_engine(reference_spec)
+    candidate = load_engine(candidate_spec)
+    failures = []
+    for seed in seeds:
+        case = generate_case(seed, steps)
+        mismatch = run_case(reference, candidate, case)
+        if mismatch is not None:
+            case = minimize(reference, candidate, case)
+            failures.append((case, run_case(reference, candidate, case)))
+    return failures
+
+
+def fuzz(candidate_spec, cases=1000, steps=64, seed=0, workers=None, reference_spec=REFERENCE):
+    """Fuzz candidate against reference, sharded over a process pool
+
+    Returns a list of (minimized case, (step, description)) failures.
+    """
+    # fail here on a bad spec rather than in every worker
+    load_engine(reference_spec)
+    load_engine(candidate_spec)
+    workers = workers or os.cpu_count()
+    seeds = range(seed, seed + cases)
+    shards = [seeds[n::workers] for n in range(workers)]
+    failures = []
+    with ProcessPoolExecutor(workers, initializer=init_worker) as pool:
+        results = pool.map(
+            run_shard,
+            [reference_spec] * workers,
+            [candidate_spec] * workers,
+            shards,
+            [steps] * workers,
+        )
+        for shard_failures in results:
+            failures.extend(shard_failures)
+    return failures
+
+
+def format_failure(case, mismatch):
+    step, description = mismatch
+    program = " ".join(case["program"][n : n + 2].hex() for n in range(0, len(case["program"]), 2))
+    state = case["state"]
+    return "\n".join(
+        (
+            f"seed {case['seed']} step {step}: {description}",
+            f"  program: {program}",
+            f"  v: {' '.join(f'{value:02x}' for value in state['v'])}",
+            f"  i={state['i']:04x} sp={state['sp']:04x} delay={state['delay']} "
+            f"sound={state['sound']} keys={case['keys']}",
+        )
+    )
+
+
+def save_cases(path, cases):
+    """Write cases as JSON, the program as a hex string"""
+    with open(path, "w") as cases_file:
+        json.dump([dict(case, program=case["program"].hex()) for case in cases], cases_file)
+
+
+def load_cases(path):
+    with open(path) as cases_file:
+        return [dict(case, program=bytes.fromhex(case["program"])) for case in json.load(cases_file)]
+
+
+def replay(candidate_spec, path, reference_spec=REFERENCE):
+    """Rerun saved cases in this process, returns (case, mismatch or None) pairs"""
+    init_worker()
+    reference = load_engine(reference_spec)
+    candidate = load_engine(candidate_spec)
+    return [(case, run_case(reference, candidate, case)) for case in load_cases(path)]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("candidate", help="engine to check, as module:attribute")
+    parser.add_argument("--reference", default=REFERENCE)
+    parser.add_argument("--cases", type=int, default=1000)
+    parser.add_argument("--steps", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--output", default="fuzz_failures.json", help="where minimized failing cases are saved"
+    )
+    parser.add_argument("--replay", metavar="PATH", help="rerun cases saved by an earlier run")
+    args = parser.parse_args()
+
+    if args.replay:
+        for case, mismatch in replay(args.candidate, args.replay, args.reference):
+            if mismatch:
+                print(format_failure(case, mismatch))
+            else:
+                print(f"seed {case['seed']}: engines agree")
+    else:
+        failures = fuzz(args.candidate, args.cases, args.steps, args.seed, args.workers, args.reference)
+        for case, mismatch in failures:
+            print(format_failure(case, mismatch))
+        print(f"{len(failures)} of {args.cases} cases differ")
+        if failures:
+            save_cases(args.output, [case for case, _ in failures])
+            print(f"minimized cases saved to {args.output}, rerun them with --replay {args.output}")
@@ -0,0 +1,349 @@
+"""
+Framebuffer recorder and player
+
+Recording format, all integers little endian except display rows:
+    header   b"C8RC", version, width, height, keyframe interval (H)
+    keyframe b"K" + 32 rows of 8 bytes, big endian, leftmost pixel is the MSB
+    delta    b"D" + changed row mask (I) + XOR of each changed row, 8 bytes
+    index    b"I" + frame count (I) + keyframe count (I)
+             + (frame number (I), file offset (Q)) per keyframe
+    trailer  index offset (Q) + b"C8RC"
+An unchanged frame costs 5 bytes. The index is written on close, a file
+without one (e.g. an interrupted run) is scanned instead.
+"""
+import bisect
+import math
+import os
+import struct
+from collections import defaultdict
+
+MAGIC = b"C8RC"
+VERSION = 1
+WIDTH, HEIGHT = 64, 32
+ROW_BYTES = WIDTH // 8
+HEADER = struct.Struct("<4sBBBH")
+MASK = struct.Struct("<I")
+INDEX = struct.Struct("<II")
+INDEX_ENTRY = struct.Struct("<IQ")
+TRAILER = struct.Struct("<Q4s")
+# shortest GIF frame delay viewers play at the stated speed, in ms
+MIN_GIF_DELAY = 20
+
+
+def pack_row(row):
+    return int("".join(map(str, row)), 2)
+
+
+def unpack_row(bits):
+    return [(bits >> (WIDTH - 1 - x)) & 1 for x in range(WIDTH)]
+
+
+class FrameRecorder:
+
+    def __init__(self, path, keyframe_interval=300):
+        """Streams frames of a chip8 display to path
+
+        A keyframe holding the whole display is written every
+        keyframe_interval frames, other frames only store XORed changed rows.
+        """
+        self.file = open(path, "wb")
+        self.keyframe_interval = keyframe_interval
+        self.frames = 0
+        self.keyframes = []
+        self.rows = None
+        self.packed = None
+        self.file.write(HEADER.pack(MAGIC, VERSION, WIDTH, HEIGHT, keyframe_interval))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, display):
+        """Record one frame, display as returned by Chip8.get_display()"""
+        if self.frames % self.keyframe_interval == 0:
+            self.rows = [list(row) for row in display]
+            self.packed = [pack_row(row) for row in display]
+            self.keyframes.append((self.frames, self.file.tell()))
+            self.file.write(b"K")
+            for bits in self.packed:
+                self.file.write(bits.to_bytes(ROW_BYTES, "big"))
+        else:
+            mask = 0
+            changes = []
+            for y, row in enumerate(display):
+                if row != self.rows[y]:
+                    bits = pack_row(row)
+                    self.rows[y] = list(row)
+                    mask |= 1 << y
+                    changes.append((bits ^ self.packed[y]).to_bytes(ROW_BYTES, "big"))
+                    self.packed[y] = bits
+            self.file.write(b"D" + MASK.pack(mask) + b"".join(changes))
+        self.frames += 1
+
+    def close(self):
+        if self.file.closed:
+            return
+        index_offset = self.file.tell()
+        self.file.write(b"I" + INDEX.pack(self.frames, len(self.keyframes)))
+        for frame, offset in self.keyframes:
+            self.file.write(INDEX_ENTRY.pack(frame, offset))
+        self.file.write(TRAILER.pack(index_offset, MAGIC))
+        self.file.close()
+
+
+class FramePlayer:
+
+    def __init__(self, path):
+        """Reads recordings made by FrameRecorder
+
+        Frames come out as lists of rows like Chip8.get_display().
+        """
+        self.file = open(path, "rb")
+        header = self.file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            self.file.close()
+            raise ValueError(f"{path} is not a chip8 recording")
+        magic, version, width, height, self.keyframe_interval = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION or (width, height) != (WIDTH, HEIGHT):
+            self.file.close()
+            raise ValueError(f"{path} is not a chip8 recording")
+        if not self._read_index():
+            self._scan()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def __len__(self):
+        return self.frames
+
+    def _read_index(self):
+        self.file.seek(0, os.SEEK_END)
+        if self.file.tell() < HEADER.size + TRAILER.size:
+            return False
+        self.file.seek(-TRAILER.size, os.SEEK_END)
+        index_offset, magic = TRAILER.unpack(self.file.read(TRAILER.size))
+        if magic != MAGIC:
+            return False
+        self.file.seek(index_offset)
+        if self.file.read(1) != b"I":
+            return False
+        self.frames, count = INDEX.unpack(self.file.read(INDEX.size))
+        entries = [INDEX_ENTRY.unpack(self.file.read(INDEX_ENTRY.size)) for _ in range(count)]
+        self.keyframe_frames = [frame for frame, _ in entries]
+        self.keyframe_offsets = [offset for _, offset in entries]
+        return True
+
+    def _scan(self):
+        """Rebuild the index by walking the records, for files never closed"""
+        self.frames = 0
+        self.keyframe_frames = []
+        self.keyframe_offsets = []
+        self.file.seek(HEADER.size)
+        while True:
+            offset = self.file.tell()
+            if self._read_record() is None:
+                break
+            if self._last_kind == b"K":
+                self.keyframe_frames.append(self.frames)
+                self.keyframe_offsets.append(offset)
+            self.frames += 1
+
+    def _read_record(self):
+        """Returns the next record as (kind, {row: bits}) or None at the end
+
+        Keyframe rows are absolute values, delta rows are XORs.
+        """
+        kind = self.file.read(1)
+        self._last_kind = kind
+        if kind == b"K":
+            data = self.file.read(HEIGHT * ROW_BYTES)
+            if len(data) < HEIGHT * ROW_BYTES:
+                return None
+            mask = (1 << HEIGHT) - 1
+        elif kind == b"D":
+            data = self.file.read(MASK.size)
+            if len(data) < MASK.size:
+                return None
+            (mask,) = MASK.unpack(data)
+            data = self.file.read(bin(mask).count("1") * ROW_BYTES)
+            if len(data) < bin(mask).count("1") * ROW_BYTES:
+                return None
+        else:
+            return None
+        rows = {}
+        n = 0
+        for y in range(HEIGHT):
+            if mask & (1 << y):
+                rows[y] = int.from_bytes(data[n : n + ROW_BYTES], "big")
+                n += ROW_BYTES
+        return kind, rows
+
+    def _packed_frames(self, start=0):
+        """Yields packed rows for frames from start, seeking to the closest keyframe"""
+        if start >= self.frames:
+            return
+        k = bisect.bisect_right(self.keyframe_frames, start) - 1
+        frame = self.keyframe_frames[k]
+        self.file.seek(self.keyframe_offsets[k])
+        packed = [0] * HEIGHT
+        while frame < self.frames:
+            kind, rows = self._read_record()
+            for y, bits in rows.items():
+                packed[y] = bits if kind == b"K" else packed[y] ^ bits
+            if frame >= start:
+                yield packed
+            frame += 1
+
+    def frame(self, n):
+        """Decode frame n"""
+        if not 0 <= n < self.frames:
+            raise IndexError(f"frame {n} out of range")
+        packed = next(self._packed_frames(n))
+        return [unpack_row(bits) for bits in packed]
+
+    def iter_frames(self, start=0):
+        for packed in self._packed_frames(start):
+            yield [unpack_row(bits) for bits in packed]
+
+    def __iter__(self):
+        return self.iter_frames()
+
+
+def record_headless(chip8, path, frames, steps_per_frame=12, pressed_keys=None, keyframe_interval=300):
+    """Run chip8 for a number of frames without a window, recording each frame
+
+    Steps per frame matches the 12 instructions Chip8Scene runs per frame.
+    """
+    pressed_keys = pressed_keys if pressed_keys is not None else defaultdict(bool)
+    with FrameRecorder(path, keyframe_interval) as recorder:
+        for _ in range(frames):
+            for _ in range(steps_per_frame):
+                chip8.fetch_next_opcode(pressed_keys)
+            recorder.record(chip8.get_display())
+
+
+def frame_surface(display, modifier):
+    import pygame
+
+    import main
+
+    surface = pygame.Surface((WIDTH * modifier, HEIGHT * modifier))
+    surface.fill(main.BLACK)
+    for y, row in enumerate(display):
+        for x, cell in enumerate(row):
+            if cell:
+                surface.fill(main.WHITE, (x * modifier, y * modifier, modifier, modifier))
+    return surface
+
+
+def export_png(path, directory, modifier=10, start=0, stop=None):
+    """Write frames start..stop as directory/frame_000000.png"""
+    import pygame
+
+    os.makedirs(directory, exist_ok=True)
+    with FramePlayer(path) as player:
+        stop = len(player) if stop is None else stop
+        for n, display in enumerate(player.iter_frames(start), start):
+            if n >= stop:
+                break
+            pygame.image.save(
+                frame_surface(display, modifier),
+                os.path.join(directory, f"frame_{n:06d}.png"),
+            )
+
+
+def gif_frame_step(fps):
+    """Keep every step-th frame so each GIF frame lasts a whole number of
+    hundredths of a second and at least MIN_GIF_DELAY ms
+
+    Returns (step, duration in ms), preferring a step up to twice the
+    smallest allowed one if that keeps the duration exact, e.g. every 3rd
+    frame for 50 ms at 60 fps.
+    """
+    smallest = max(1, math.ceil(MIN_GIF_DELAY * fps / 1000))
+    for step in range(smallest, 2 * smallest + 1):
+        if (step * 100) % fps == 0:
+            return step, step * 1000 // fps
+    return smallest, round(smallest * 100 / fps) * 10
+
+
+def export_gif(path, gif_path, modifier=10, start=0, stop=None, fps=60):
+    """Write frames start..stop as an animated GIF, needs Pillow
+
+    GIF delays are in hundredths of a second and viewers play delays
+    under 20 ms slowly, so frames are dropped to keep real-time speed,
+    see gif_frame_step. Pillow keeps every frame in memory while writing,
+    pass start and stop to export parts of long runs.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ImportError("GIF export needs Pillow, pip install pillow") from None
+    import main
+
+    step, duration = gif_frame_step(fps)
+    images = []
+    with FramePlayer(path) as player:
+        stop = len(player) if stop is None else stop
+        for n, display in enumerate(player.iter_frames(start), start):
+            if n >= stop:
+                break
+            if (n - start) % step:
+                continue
+            image = Image.new("P", (WIDTH, HEIGHT))
+            image.putpalette(main.BLACK + main.WHITE)
+            image.putdata([cell for row in display for cell in row])
+            images.append(image.resize((WIDTH * modifier, HEIGHT * modifier), Image.NEAREST))
+    if images:
+        images[0].save(
+            gif_path, save_all=True, append_images=images[1:], duration=duration, loop=0
+        )
+
+
+def play(path, start=0):
+    """Replay a recording through the pygame renderer"""
+    import pygame
+
+    import main
+    import scenes
+
+    with FramePlayer(path) as player:
+        grid_rect = main.graphic_grid(main.SIZE, main.MODIFIER)
+        pygame.init()
+        screen = pygame.display.set_mode((main.WIDTH * main.MODIFIER, main.HEIGHT * main.MODIFIER))
+        pygame.display.set_caption("Chip8 Replay")
+        clock = pygame.time.Clock()
+        font = pygame.font.SysFont("monospace", 24)
+
+        active_scene = scenes.ReplayScene(player.iter_frames(start))
+        while active_scene != None:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    active_scene.terminate()
+            active_scene.update()
+            active_scene.render(screen, grid_rect, font, clock)
+            active_scene = active_scene.next
+
+            pygame.display.update()
+            clock.tick(60)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) == 2:
+        play(sys.argv[1])
+    elif len(sys.argv) == 4 and sys.argv[2] == "png":
+        export_png(sys.argv[1], sys.argv[3])
+    elif len(sys.argv) == 4 and sys.argv[2] == "gif":
+        export_gif(sys.argv[1], sys.argv[3])
+    else:
+        print("Usage: chip8_recorder.py recording [png directory | gif file.gif]")
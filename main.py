@@ -8,6 +8,7 @@ from pygame.locals import *
 
 import scenes
 from chip8 import Chip8
+from chip8_recorder import FrameRecorder
 
 # constants
 SIZE = WIDTH, HEIGHT = 64, 32
@@ -26,7 +27,7 @@ def graphic_grid(size, modifier):
     return grid
 
 
-def main(chip_program):
+def main(chip_program, recording=None):
     with open(chip_program, "rb") as chip_file:
         grid_rect = graphic_grid(SIZE, MODIFIER)
 
@@ -42,32 +43,38 @@ def main(chip_program):
         font = pygame.font.SysFont("monospace", 24)
 
         # startup chip8
-        chip8 = Chip8(chip_file)
-
-        # Change to boot screen
-        active_scene = scenes.BootScene(pygame.time.get_ticks(), chip8)
-        active_scene = active_scene.next
-
-        # Event loop
-        while active_scene != None:
-            pressed_keys = pygame.key.get_pressed()
-            filtered_events = []
-            for event in pygame.event.get():
-                quit_attempt = False
-                if event.type == pygame.QUIT:
-                    quit_attempt = True
-                if quit_attempt:
-                    active_scene.terminate()
-                else:
-                    filtered_events.append(event)
-
-            active_scene.process_input(filtered_events, pressed_keys)
-            active_scene.update()
-            active_scene.render(screen, grid_rect, font, clock)
+        chip8 = Chip8(chip_file, quirks="auto")
+        recorder = FrameRecorder(recording) if recording else None
+
+        try:
+            # Change to boot screen
+            active_scene = scenes.BootScene(pygame.time.get_ticks(), chip8, recorder)
             active_scene = active_scene.next
 
-            pygame.display.update()
-            clock.tick(60)
+            # Event loop
+            while active_scene != None:
+                pressed_keys = pygame.key.get_pressed()
+                filtered_events = []
+                for event in pygame.event.get():
+                    quit_attempt = False
+                    if event.type == pygame.QUIT:
+                        quit_attempt = True
+                    if quit_attempt:
+                        active_scene.terminate()
+                    else:
+                        filtered_events.append(event)
+
+                active_scene.process_input(filtered_events, pressed_keys)
+                active_scene.update()
+                active_scene.render(screen, grid_rect, font, clock)
+                active_scene = active_scene.next
+
+                pygame.display.update()
+                clock.tick(60)
+        finally:
+            # always write the index, even when the loop raised
+            if recorder:
+                recorder.close()
 
 
 if __name__ == "__main__":
@@ -75,5 +82,7 @@ if __name__ == "__main__":
 
     if len(argv) == 2:
         main(argv[1])
+    elif len(argv) == 3:
+        main(argv[1], argv[2])
     else:
         print("Please supply chip 8 program.")
\ No newline at end of file
@@ -30,11 +30,12 @@ class SceneBase:
 
 
 class BootScene(SceneBase):
-    def __init__(self, time, chip8):
+    def __init__(self, time, chip8, recorder=None):
         SceneBase.__init__(self)
         # we do this scene for 2 secs
         self.exit_time = time + 0.5 * 10 ** 3
         self.chip8 = chip8
+        self.recorder = recorder
 
     def render(self, background, grid_rect, *args):
         # bit of fun eh
@@ -50,25 +51,48 @@ class BootScene(SceneBase):
         curr_time = pygame.time.get_ticks()
         if curr_time >= self.exit_time:
             background.fill(main.BLACK)
-            self.switch_scene(Chip8Scene(self.chip8))
+            self.switch_scene(Chip8Scene(self.chip8, self.recorder))
 
 
 class Chip8Scene(SceneBase):
-    def __init__(self, chip8):
+    def __init__(self, chip8, recorder=None):
         SceneBase.__init__(self)
         self.chip8 = chip8
+        self.recorder = recorder
 
     def update(self):
         for _ in range(12):
             self.chip8.fetch_next_opcode(self.pressed_keys)
+        if self.recorder:
+            self.recorder.record(self.chip8.get_display())
 
     def render(self, background, grid_rect, *args):
-        display = self.chip8.get_display()
-        for y in range(32):
-            for x in range(64):
-                if display[y][x] ^ grid_rect[y][x][1]:
-                    if display[y][x]:
-                        pygame.draw.rect(background, main.WHITE, grid_rect[y][x][0], 0)
-                    else:
-                        pygame.draw.rect(background, main.BLACK, grid_rect[y][x][0], 0)
-                    grid_rect[y][x][1] = display[y][x]
+        draw_display(self.chip8.get_display(), background, grid_rect)
+
+
+class ReplayScene(SceneBase):
+    def __init__(self, frames):
+        SceneBase.__init__(self)
+        self.frames = frames
+        self.display = None
+
+    def update(self):
+        self.display = next(self.frames, None)
+        if self.display is None:
+            self.terminate()
+
+    def render(self, background, grid_rect, *args):
+        if self.display is not None:
+            draw_display(self.display, background, grid_rect)
+
+
+def draw_display(display, background, grid_rect):
+    """Draw the cells of display that changed since the last draw"""
+    for y in range(32):
+        for x in range(64):
+            if display[y][x] ^ grid_rect[y][x][1]:
+                if display[y][x]:
+                    pygame.draw.rect(background, main.WHITE, grid_rect[y][x][0], 0)
+                else:
+                    pygame.draw.rect(background, main.BLACK, grid_rect[y][x][0], 0)
+                grid_rect[y][x][1] = display[y][x]